@@ -2,15 +2,27 @@ from astropy.io import fits
 import matplotlib.pyplot as plt
 import numpy as np
 from .download_data_functions import download_data
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import multiprocessing
 import os
+import shutil
 import pandas as pd
-import csv
+
+try:
+    import fitsio
+except ImportError:
+    fitsio = None
 
 def preprocess_poshist_data(year_start, year_end):
     """
     Process and save Fermi POSHIST data across multiple years.
 
+    The download of the next year runs in a background thread while the
+    current year is converted, so each year costs roughly the longer of
+    the two stages rather than their sum. The conversion process pool is
+    created once, before the download thread starts, and reused for every
+    year.
+
     Args:
         year_start (int): Start year for data processing.
         year_end (int): End year for data processing.
@@ -19,40 +31,67 @@ def preprocess_poshist_data(year_start, year_end):
         pd.DataFrame: Processed POSHIST data.
     """
     columns = ['TSTART', 'QSJ_1', 'QSJ_2', 'QSJ_3', 'QSJ_4']
-    poshist_data = pd.DataFrame(columns=columns)
+    output_dir = 'poshist'
+    year_arrays = []
 
-    for year in range(year_start, year_end):
-        output_dir = 'poshist'
-        download_data(range(year, year + 1), Daily_or_Burst='Daily', url_file_string="glg_poshist_all", output_dir=output_dir)
+    with conversion_pool() as converter, ThreadPoolExecutor(max_workers=1) as downloader:
+        if year_start < year_end:
+            next_download = downloader.submit(download_poshist_year, year_start, output_dir)
 
-        save_data_to_csv(f"./fermi_data/{output_dir}", f"./fermi_data/{output_dir}")
-        npy_path = f"./fermi_data/{output_dir}/poshist_data_{year}.npy"
-        combine_csv_to_npy(csv_folder=f"./fermi_data/{output_dir}", output_path=npy_path)
+        for year in range(year_start, year_end):
+            fits_folder_path = next_download.result()
+            if year + 1 < year_end:
+                next_download = downloader.submit(download_poshist_year, year + 1, output_dir)
 
-        if os.path.exists(npy_path):
-            loaded_array = np.load(npy_path, allow_pickle=True)[:, 0:5]
-            year_df = pd.DataFrame(loaded_array, columns=columns)
-            poshist_data = pd.concat([poshist_data, year_df], ignore_index=True)
+            sample_dir = os.path.join(fits_folder_path, "samples")
+            save_data_to_npy(fits_folder_path, sample_dir, executor=converter)
+            npy_path = f"./fermi_data/{output_dir}/poshist_data_{year}.npy"
+            combine_npy_files(npy_folder=sample_dir, output_path=npy_path)
 
-        fits_folder_path = f"./fermi_data/{output_dir}"
-        for file in os.listdir(fits_folder_path):
-            if file.endswith('.csv') or file.endswith(('.fit', '.fits')):
-                os.remove(os.path.join(fits_folder_path, file))
+            if os.path.exists(npy_path):
+                year_arrays.append(np.load(npy_path)[:, 0:5])
 
-        print(f"Processed and saved data for {year}")
-        print(poshist_data.shape)
+            shutil.rmtree(fits_folder_path)
 
-        npy_file_name = f"./fermi_data/{output_dir}/poshist_data_{year}.npy"
-        np.save(npy_file_name, poshist_data.to_numpy())
+            print(f"Processed and saved data for {year}")
+            print(sum(len(year_array) for year_array in year_arrays))
+
+    if year_arrays:
+        poshist_array = np.concatenate(year_arrays, axis=0)
+    else:
+        poshist_array = np.empty((0, len(columns)))
 
     npy_file_name = f"./fermi_data/poshist/poshist_data.npy"
-    np.save(npy_file_name, poshist_data.to_numpy())
+    np.save(npy_file_name, poshist_array)
+
+    poshist_data = pd.DataFrame(poshist_array, columns=columns)
     return poshist_data
 
+def download_poshist_year(year, output_dir='poshist'):
+    """
+    Download one year of daily POSHIST files into their own folder.
+
+    Each year gets a separate folder so a prefetched year never mixes
+    with the year that is still being converted.
+
+    Args:
+        year (int): Year to download.
+        output_dir (str): Data folder under ./fermi_data.
+
+    Returns:
+        str: Folder containing the downloaded FITS files.
+    """
+    year_dir = f"{output_dir}/{year}"
+    download_data(range(year, year + 1), Daily_or_Burst='Daily', url_file_string="glg_poshist_all", output_dir=year_dir)
+    return f"./fermi_data/{year_dir}"
+
 def extract_fits_data(fits_file, sample_size=1000):
     """
     Extract quaternion and timestamp data from a FITS file.
 
+    Uses fitsio when it is installed, so that CFITSIO reads only the
+    sampled rows from disk; otherwise falls back to astropy.
+
     Args:
         fits_file (str): Path to the FITS file.
         sample_size (int): Number of samples to extract.
@@ -60,31 +99,36 @@ def extract_fits_data(fits_file, sample_size=1000):
     Returns:
         tuple: Arrays of sampled time and quaternion data.
     """
-    with fits.open(fits_file) as hdul:
-        data = hdul[1].data
-        qs_1 = data['QSJ_1']
-        qs_2 = data['QSJ_2']
-        qs_3 = data['QSJ_3']
-        qs_4 = data['QSJ_4']
-        time = data['SCLK_UTC']
-
-        total_len = len(time)
-        if total_len == 0:
-            return ([], [], [], [], [])
-
-        indices = np.linspace(0, total_len - 1, num=min(sample_size, total_len), dtype=int)
-
-        return (
-            time[indices],
-            qs_1[indices],
-            qs_2[indices],
-            qs_3[indices],
-            qs_4[indices]
-        )
+    columns = ['SCLK_UTC', 'QSJ_1', 'QSJ_2', 'QSJ_3', 'QSJ_4']
+
+    if fitsio is not None:
+        with fitsio.FITS(fits_file) as fits_handle:
+            table = fits_handle[1]
+            total_len = table.get_nrows()
+            if total_len == 0:
+                return ([], [], [], [], [])
+
+            indices = np.linspace(0, total_len - 1, num=min(sample_size, total_len), dtype=np.int64)
+            rows = table.read(columns=columns, rows=indices)
+    else:
+        with fits.open(fits_file) as hdul:
+            table = hdul[1]
+            total_len = table.header['NAXIS2']
+            if total_len == 0:
+                return ([], [], [], [], [])
+
+            indices = np.linspace(0, total_len - 1, num=min(sample_size, total_len), dtype=np.int64)
+
+            """
+            Select the sampled rows first so only those records are decoded
+            """
+            rows = table.data[indices]
+
+    return tuple(rows[column] for column in columns)
 
 def process_one_file(fits_path, output_folder):
     """
-    Process a single FITS file and save extracted data as a CSV file.
+    Process a single FITS file and save extracted data as a NPY file.
 
     Args:
         fits_path (str): Path to the FITS file.
@@ -101,26 +145,42 @@ def process_one_file(fits_path, output_folder):
             print(f"Skipped empty file: {fits_name}")
             return
 
-        csv_name = os.path.splitext(fits_name)[0] + '.csv'
-        csv_path = os.path.join(output_folder, csv_name)
+        npy_name = os.path.splitext(fits_name)[0] + '.npy'
+        npy_path = os.path.join(output_folder, npy_name)
 
-        with open(csv_path, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Time', 'QSJ_1', 'QSJ_2', 'QSJ_3', 'QSJ_4'])
-            for t, q1, q2, q3, q4 in zip(time, qs_1, qs_2, qs_3, qs_4):
-                writer.writerow([t, q1, q2, q3, q4])
+        samples = np.column_stack([time, qs_1, qs_2, qs_3, qs_4]).astype(np.float64)
+        np.save(npy_path, samples)
 
     except Exception as e:
         print(f"Error processing {fits_name}: {e}")
 
-def save_data_to_csv(fits_folder, output_folder, max_workers=8):
+def conversion_pool(max_workers=None):
     """
-    Save processed quaternion data from FITS files to CSV using multi-threading.
+    Create the process pool used to convert POSHIST FITS files.
+
+    Workers are started with "spawn" rather than fork: the caller may
+    already be running download threads (or, in a notebook, kernel
+    threads), and forking a multi-threaded process can deadlock the
+    child on locks those threads held.
+
+    Args:
+        max_workers (int): Number of worker processes (defaults to the CPU count).
+
+    Returns:
+        ProcessPoolExecutor: The process pool.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+def save_data_to_npy(fits_folder, output_folder, max_workers=None, executor=None):
+    """
+    Save processed quaternion data from FITS files to NPY using multiple processes.
 
     Args:
         fits_folder (str): Folder containing FITS files.
-        output_folder (str): Folder to save CSV files.
-        max_workers (int): Number of threads for concurrent processing.
+        output_folder (str): Folder to save NPY files.
+        max_workers (int): Number of worker processes (defaults to the CPU count).
+        executor (ProcessPoolExecutor): Pool to reuse; a new one from
+            conversion_pool is created and shut down when omitted.
 
     Returns:
         None
@@ -133,43 +193,44 @@ def save_data_to_csv(fits_folder, output_folder, max_workers=8):
         if f.endswith(('.fit', '.fits'))
     ]
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_one_file, fp, output_folder) for fp in fits_files]
-        for future in as_completed(futures):
-            pass
+    if executor is None:
+        with conversion_pool(max_workers) as executor:
+            save_data_to_npy(fits_folder, output_folder, executor=executor)
+        return
+
+    futures = [executor.submit(process_one_file, fp, output_folder) for fp in fits_files]
+    for future in as_completed(futures):
+        future.result()
 
-def combine_csv_to_npy(csv_folder, output_path='combined_data.npy'):
+def combine_npy_files(npy_folder, output_path='combined_data.npy'):
     """
-    Combine CSV files into a single NumPy file.
+    Combine per-file NPY samples into a single NumPy file.
 
     Args:
-        csv_folder (str): Folder containing CSV files.
+        npy_folder (str): Folder containing the per-file NPY files.
         output_path (str): Path to save the combined NPY file.
 
     Returns:
         None
     """
     all_data = []
-    csv_files = [
-        f for f in os.listdir(csv_folder)
-        if f.endswith('.csv')
-    ]
+    npy_files = sorted(
+        f for f in os.listdir(npy_folder)
+        if f.endswith('.npy')
+    )
 
-    for csv_file in csv_files:
-        csv_path = os.path.join(csv_folder, csv_file)
+    for npy_file in npy_files:
+        npy_path = os.path.join(npy_folder, npy_file)
         try:
-            df = pd.read_csv(csv_path)
-            df['SourceFile'] = csv_file
-            all_data.append(df)
+            all_data.append(np.load(npy_path))
         except Exception as e:
-            print(f"Error reading {csv_file}: {e}")
+            print(f"Error reading {npy_file}: {e}")
 
     if all_data:
-        combined_df = pd.concat(all_data, ignore_index=True)
-        np.save(output_path, combined_df.to_numpy())
+        np.save(output_path, np.concatenate(all_data, axis=0))
         print(f"Combined data saved to: {output_path}")
     else:
-        print("No CSV data found to combine.")
+        print("No NPY data found to combine.")
 
 if __name__ == "__main__":
     preprocess_poshist_data(2015, 2026)
@@ -2,6 +2,7 @@ from astropy.io import fits
 import matplotlib.pyplot as plt
 import numpy as np
 from .download_data_functions import download_data
+from .util import uniform_count_rate
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 import re
@@ -63,7 +64,7 @@ def extract_fits_data(fits_file):
         id = re.search(r'bn\d{9}', hdul[0].header['FILENAME'])
         id = id.group(0) if id else ""
         detector = re.search(r"glg_tte_(\w+)_bn", hdul[0].header['FILENAME']).group(1)
-        ph_cnt = len(hdul['EVENTS'].data)
+        ph_cnt = hdul['EVENTS'].header['NAXIS2']
         return (id, detector, ph_cnt)
 
 def extract_fits_excess_photon_data(bcat_data, filename, bins=256):
@@ -78,9 +79,8 @@ def extract_fits_excess_photon_data(bcat_data, filename, bins=256):
     Returns:
         tuple: (ID, detector, total excess counts).
     """
-    with fits.open(filename) as hdul:
-        tte_data = pd.DataFrame(columns=['TIME'])
-        tte_data['TIME'] = hdul['EVENTS'].data['TIME']
+    with fits.open(filename, memmap=True) as hdul:
+        event_time = hdul['EVENTS'].data['TIME']
         id = re.search(r'bn\d{9}', hdul[0].header['FILENAME'])
         id = id.group(0) if id else ""
         detector = re.search(r"glg_tte_(\w+)_bn", hdul[0].header['FILENAME']).group(1)
@@ -92,16 +92,9 @@ def extract_fits_excess_photon_data(bcat_data, filename, bins=256):
         tstart = target['TSTART'].iloc[0]
         tstop = target['TSTOP'].iloc[0]
 
-    time_bin = tte_data['TIME']
-    bin_edges = np.linspace(time_bin.min(), time_bin.max(), bins)
-    bin_size = bin_edges[1] - bin_edges[0]
-    digitized = np.digitize(time_bin, bin_edges)
+    bin_edges, count_rate = uniform_count_rate(event_time, bins)
     time = bin_edges[1:]
-    count_rate = [np.sum(digitized == i) / bin_size for i in range(1, len(bin_edges))]
-
-    time = np.asarray(time)
-    count_rate = np.asarray(count_rate)
-    Baseline = np.average(count_rate)
+    Baseline = count_rate.mean()
     mask = (time >= tstart) & (time <= tstop)
     time_window = time[mask]
     counts_window = count_rate[mask]
@@ -1,9 +1,16 @@
 from astropy.io import fits
 import sys
 import io
+import os
+import hashlib
 import numpy as np
 import pandas as pd
 
+try:
+    from fast_histogram import histogram1d
+except ImportError:
+    histogram1d = None
+
 """
 Function: show_data_hdu
 Input:
@@ -56,6 +63,46 @@ def show_data_hdu(fits_file, hdu_num, snapshot_filename="header_snapshot.txt"):
 
         print(f"\nHeader snapshot saved to {snapshot_filename}")
 
+"""
+Function: slerp_qs
+Input:
+- t (np.array): Sorted sample times.
+- qs (np.array): Quaternions at the sample times, shape (N, 4).
+- time_values (np.array): Times within [t[0], t[-1]] to interpolate at.
+Output:
+- np.array: Spherically interpolated quaternions, shape (len(time_values), 4).
+"""
+def slerp_qs(t, qs, time_values):
+    if len(t) == 1:
+        return np.repeat(qs, len(time_values), axis=0)
+
+    """
+    Find the two samples bracketing each requested time
+    """
+    idx = np.clip(np.searchsorted(t, time_values, side='right'), 1, len(t) - 1)
+    q0 = qs[idx - 1]
+    q1 = qs[idx]
+    dt = t[idx] - t[idx - 1]
+    alpha = np.divide(time_values - t[idx - 1], dt, out=np.zeros(len(idx)), where=dt > 0)
+
+    """
+    q and -q are the same rotation, so take the shorter arc
+    """
+    dot = np.sum(q0 * q1, axis=1)
+    q1 = np.where(dot[:, np.newaxis] < 0, -q1, q1)
+    omega = np.arccos(np.clip(np.abs(dot), -1.0, 1.0))
+    sin_omega = np.sin(omega)
+
+    """
+    Fall back to linear weights where the two quaternions (nearly) coincide
+    """
+    linear = sin_omega < 1e-6
+    sin_omega = np.where(linear, 1.0, sin_omega)
+    w0 = np.where(linear, 1 - alpha, np.sin((1 - alpha) * omega) / sin_omega)
+    w1 = np.where(linear, alpha, np.sin(alpha * omega) / sin_omega)
+
+    return w0[:, np.newaxis] * q0 + w1[:, np.newaxis] * q1
+
 """
 Function: interpolate_qs_for_time
 Input:
@@ -67,38 +114,24 @@ Output:
 def interpolate_qs_for_time(df, time_values):
     
     """
-    Ensure that the time column is sorted
+    Sort the complete samples by time as plain arrays for searchsorted
     """
-    df = df.sort_values(by='TSTART')
+    qs_columns = ['QSJ_1', 'QSJ_2', 'QSJ_3', 'QSJ_4']
+    samples = df.reindex(columns=['TSTART'] + qs_columns).astype(float).dropna().sort_values(by='TSTART')
+    t = samples['TSTART'].to_numpy()
+    qs = samples[qs_columns].to_numpy()
+    time_values = np.asarray(time_values)
 
     """
-    Interpolate the quaternion values using linear interpolation
-    """
-    df_interpolated = df.set_index('TSTART').interpolate(method='index', limit_direction='both')
-
+    Interpolate the quaternions with SLERP, NaN outside the sampled range
     """
-    Initialize lists to store interpolated results for each time in `time_values`
-    """
-    interpolated_qs = []
-
-    for time_value in time_values:
-        nearest_time_index = df_interpolated.index.searchsorted(time_value, side='left')
+    interpolated_qs = np.full((len(time_values), len(qs_columns)), np.nan)
+    if len(t) > 0:
+        in_range = (time_values >= t[0]) & (time_values <= t[-1])
+        interpolated_qs[in_range] = slerp_qs(t, qs, time_values[in_range])
 
-        """
-        Handle out-of-bounds case
-        """
-        if nearest_time_index >= len(df_interpolated):
-            qs_1 = qs_2 = qs_3 = qs_4 = np.nan
-        else:
-            row = df_interpolated.iloc[nearest_time_index]
-            qs_1 = row.get('QSJ_1', np.nan)
-            qs_2 = row.get('QSJ_2', np.nan)
-            qs_3 = row.get('QSJ_3', np.nan)
-            qs_4 = row.get('QSJ_4', np.nan)
-
-        interpolated_qs.append([time_value, qs_1, qs_2, qs_3, qs_4])
-
-    interpolated_df = pd.DataFrame(interpolated_qs, columns=['TSTART', 'QSJ_1', 'QSJ_2', 'QSJ_3', 'QSJ_4'])
+    interpolated_df = pd.DataFrame(interpolated_qs, columns=qs_columns)
+    interpolated_df.insert(0, 'TSTART', time_values)
     return interpolated_df
 
 """
@@ -223,31 +256,35 @@ def compare_time_within_range(fermi_data, gw_data, time_range_seconds=86400):
     gw_data['ALIGNED_SEC'] = gw_data['ALIGNED_SEC'] + (gw_start_date - pd.Timestamp("1980-01-01")).total_seconds()
 
     """
-    Initialize an empty list to store the matches
+    Pull the needed columns out as arrays once instead of building a Series per row
     """
-    matched_data = []
+    fermi_sec = fermi_data['ALIGNED_SEC'].to_numpy(dtype=float)
+    gw_sec = gw_data['ALIGNED_SEC'].to_numpy(dtype=float)
 
     """
-    Compare each 'ALIGNED_SEC' in fermi_data with each 'ALIGNED_SEC' in gw_data
+    Compare each 'ALIGNED_SEC' in fermi_data with all of gw_data in one vectorized pass
     """
-    for _, fermi_row in fermi_data.iterrows():
-        for _, gw_row in gw_data.iterrows():
-            if abs(fermi_row['ALIGNED_SEC'] - gw_row['ALIGNED_SEC']) <= time_range_seconds:  # Check if time difference is within the specified range
-                """
-                Create a dictionary to store the matched data, including all fermi_data columns
-                """
-                match = {'grb_time': fermi_row['TSTART'],
-                         'grb_ra': fermi_row['RA'],
-                         'grb_dec': fermi_row['DEC'], 
-                         'gw_time': gw_row['times'], 
-                         'time_diff': abs(fermi_row['ALIGNED_SEC'] - gw_row['ALIGNED_SEC']),
-                         'GRB_ID': fermi_row['ID']}
-                matched_data.append(match)
+    fermi_idx = []
+    gw_idx = []
+    for i in range(len(fermi_sec)):
+        close = np.nonzero(np.abs(fermi_sec[i] - gw_sec) <= time_range_seconds)[0]  # Check if time difference is within the specified range
+        fermi_idx.append(np.full(len(close), i))
+        gw_idx.append(close)
+    fermi_idx = np.concatenate(fermi_idx) if fermi_idx else np.array([], dtype=int)
+    gw_idx = np.concatenate(gw_idx) if gw_idx else np.array([], dtype=int)
 
     """
     Create a DataFrame from the matches
     """
-    matched_df = pd.DataFrame(matched_data)
+    if len(fermi_idx) == 0:
+        matched_df = pd.DataFrame()
+    else:
+        matched_df = pd.DataFrame({'grb_time': fermi_data['TSTART'].to_numpy()[fermi_idx],
+                                   'grb_ra': fermi_data['RA'].to_numpy()[fermi_idx],
+                                   'grb_dec': fermi_data['DEC'].to_numpy()[fermi_idx],
+                                   'gw_time': gw_data['times'].to_numpy()[gw_idx],
+                                   'time_diff': np.abs(fermi_sec[fermi_idx] - gw_sec[gw_idx]),
+                                   'GRB_ID': fermi_data['ID'].to_numpy()[fermi_idx]})
 
     if len(matched_df)==0:
         print(f"No matching times found within {time_range_seconds} seconds.")
@@ -261,13 +298,91 @@ def convert_cartesian_to_spherical(cartesian_coords):
     Convert Cartesian coordinates to spherical coordinates (RA, DEC).
     """
     x, y, z = cartesian_coords
-    r = np.sqrt(x**2 + y**2 + z**2)
+    inv_r = 1.0 / np.sqrt(x*x + y*y + z*z)
     ra = np.arctan2(y, x)
-    dec = np.arcsin(z / r)
+    dec = np.arcsin(z * inv_r)
     ra = np.degrees(ra) % 360  # Convert to degrees and wrap to [0, 360)
     dec = np.degrees(dec)  # Convert to degrees
     return ra, dec
 
+"""
+Function: uniform_count_rate
+Input:
+- time (np.array): Event times.
+- bins (int): Number of bin edges spanning [time.min(), time.max()].
+Output:
+- tuple: Bin edges (bins,) and count rate in each of the bins - 1 bins (counts/s).
+"""
+def uniform_count_rate(time, bins=256):
+    time = np.ascontiguousarray(time, dtype=np.float64)
+    t0 = time.min()
+    t1 = time.max()
+    bin_edges = np.linspace(t0, t1, bins)
+    bin_size = bin_edges[1] - bin_edges[0]
+
+    if histogram1d is not None:
+        """
+        Widen the upper edge by one ulp so events at time.max() land in the last bin, as below
+        """
+        counts = histogram1d(time, bins=bins - 1, range=(t0, np.nextafter(t1, np.inf)))
+    else:
+        """
+        The bins are uniform, so each event's bin index is a rescale of its time; no per-event binary search
+        """
+        bin_index = ((time - t0) * ((bins - 1) / (t1 - t0))).astype(np.intp)
+        np.clip(bin_index, 0, bins - 2, out=bin_index)
+        counts = np.bincount(bin_index, minlength=bins - 1)
+    count_rate = counts / bin_size
+
+    return bin_edges, count_rate
+
+"""
+Function: cached_tte_count_rate
+Input:
+- tte_file (str): Path to the TTE FITS file.
+- bins (int): Number of bin edges spanning the event times.
+- cache_dir (str or None): Folder to keep the binned light curve in; None disables caching.
+Output:
+- tuple: Bin edges (bins,) and count rate (bins - 1,), as returned by uniform_count_rate.
+"""
+def cached_tte_count_rate(tte_file, bins=256, cache_dir=None):
+    """
+    The binned light curve depends only on the EVENTS times and bins, so with a cache_dir keep
+    it in a .npz there. The file name hashes the absolute path, so same-named files from
+    different folders do not collide, and the .npz records the source path, size, mtime and
+    bins, which must all still match for the cached copy to be reused
+    """
+    cache_file = None
+    if cache_dir is not None:
+        tte_path = os.path.abspath(tte_file)
+        stat = os.stat(tte_path)
+        source = f"{tte_path}|{stat.st_size}|{stat.st_mtime_ns}"
+        path_hash = hashlib.sha1(tte_path.encode()).hexdigest()[:16]
+        cache_name = f"{os.path.splitext(os.path.basename(tte_file))[0]}_{path_hash}_count_rate_{bins}.npz"
+        cache_file = os.path.join(cache_dir, cache_name)
+        if os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as cached:
+                    if str(cached['source']) == source and int(cached['bins']) == bins:
+                        return cached['bin_edges'], cached['count_rate']
+            except (OSError, KeyError, ValueError):
+                pass
+
+    with fits.open(tte_file, memmap=True) as hdul:
+        bin_edges, count_rate = uniform_count_rate(hdul['EVENTS'].data['TIME'], bins)
+
+    """
+    The cache is only an optimization, so a folder that cannot be written to is not an error
+    """
+    if cache_file is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez(cache_file, bin_edges=bin_edges, count_rate=count_rate, source=source, bins=bins)
+        except OSError as e:
+            print(f"Could not cache count rate to {cache_file}: {e}")
+
+    return bin_edges, count_rate
+
 def extract_tte_data(tte_file):
     
     with fits.open(tte_file) as hdul:
@@ -2,41 +2,80 @@
 # Functions include creating plots for various datasets and saving them to files.
 
 from astropy.io import fits
+import math
+import os
+import matplotlib
+
+"""
+Batch runs (GRB_BATCH set) only write files, so render with the non-interactive Agg backend
+"""
+if os.environ.get('GRB_BATCH'):
+    matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
-import os
 from matplotlib.ticker import LogFormatterMathtext
 import pandas as pd
+from .util import cached_tte_count_rate, uniform_count_rate
+
+try:
+    from numba import get_num_threads, njit, prange
+except ImportError:
+    njit = None
+
+"""
+Fermi GBM detectors: name -> row of _DETECTOR_AZZEN, which holds the
+(azimuth, zenith) pointing of each detector in spacecraft coordinates
+"""
+_DETECTOR_INDEX = {
+    'n0': 0, 'n1': 1, 'n2': 2, 'n3': 3, 'n4': 4, 'n5': 5, 'n6': 6,
+    'n7': 7, 'n8': 8, 'n9': 9, 'na': 10, 'nb': 11, 'b0': 12, 'b1': 13,
+}
+_DETECTOR_AZZEN = np.array([
+    (45.89, 90.00 - 20.58),
+    (45.11, 90.00 - 45.31),
+    (58.44, 90.00 - 90.21),
+    (314.87, 90.00 - 45.24),
+    (303.15, 90.00 - 90.27),
+    (3.35, 90.00 - 89.79),
+    (224.93, 90.00 - 20.43),
+    (224.62, 90.00 - 46.18),
+    (236.61, 90.00 - 89.97),
+    (135.19, 90.00 - 45.55),
+    (123.73, 90.00 - 90.42),
+    (183.74, 90.00 - 90.32),
+    (0.00, 90.00 - 90.00),
+    (180.00, 90.00 - 90.00),
+], dtype=np.float64)
+
+"""
+One tab20 color per detector, resampled once at import rather than on every plot call
+"""
+_TAB20 = matplotlib.colormaps['tab20'].resampled(len(_DETECTOR_INDEX))
 
 """
 Function: create_time_data_plots
 Input:
 - df (pd.DataFrame): DataFrame containing time data.
 - output_folder (str): Folder to save the plots.
+- show (bool): Whether to display the plots after saving them.
 Output:
 - None: Saves time-based plots to the specified folder.
 """
-def create_time_data_plots(df, output_folder):
+def create_time_data_plots(df, output_folder, show=False):
     output_dir = f"./{output_folder}/"
     os.makedirs(output_dir, exist_ok=True)
 
-    plt.figure(figsize=(10, 6))
-
     """
-    Convert 'DATE' column to datetime format without modifying the original DataFrame
+    Convert valid 'DATE' values to datetime without modifying the original DataFrame
     """
-    date_series = pd.to_datetime(df['DATE'], errors='coerce')
+    date_series = pd.to_datetime(df['DATE'].dropna(), errors='coerce').dropna()
 
     """
-    Calculate the difference in years from 2015-01-01 without adding to df
+    Calculate the difference in years from 2015-01-01 with integer second arithmetic
     """
-    start_date = pd.to_datetime('2015-01-01')
-    years_since_2015 = (date_series - start_date).dt.total_seconds() / (60 * 60 * 24 * 365.25)
-
-    """
-    Drop rows with invalid 'DATE' values (from the calculated series)
-    """
-    valid_dates = years_since_2015.dropna()
+    seconds = date_series.to_numpy().astype('datetime64[s]').astype(np.int64)
+    start_second = np.datetime64('2015-01-01', 's').astype(np.int64)
+    valid_dates = (seconds - start_second) / (60 * 60 * 24 * 365.25)
 
     """
     Define bins for the histogram
@@ -46,7 +85,7 @@ def create_time_data_plots(df, output_folder):
     """
     Plot the histogram for GRB events over time (in years)
     """
-    plt.figure(figsize=(10, 6))
+    fig = plt.figure(figsize=(10, 6))
     plt.hist(valid_dates, bins=years_bins, color='blue', alpha=0.7)
     plt.xlabel(r'Years since 2015-01-01 [yr]', fontsize=16)
     plt.ylabel('Number of Events', fontsize=16)
@@ -54,15 +93,16 @@ def create_time_data_plots(df, output_folder):
     ax = plt.gca()
     ax.tick_params(axis='x', labelsize=14)
     ax.tick_params(axis='y', labelsize=14)
-    plt.savefig(os.path.join(output_dir, "GRB_events_over_time_years.png"))
-    plt.show()
-    plt.close()
+    fig.savefig(os.path.join(output_dir, "GRB_events_over_time_years.png"))
+    if show:
+        plt.show()
+    plt.close(fig)
 
     """
     Convert 'T90' values to numeric and filter valid values
     """
-    t90_values = pd.to_numeric(df['T90'], errors='coerce').dropna()
-    valid_t90 = t90_values[(t90_values > 0) & (t90_values.between(1e-3, 1e3))]
+    t90_values = pd.to_numeric(df['T90'], errors='coerce').to_numpy(dtype=float)
+    valid_t90 = t90_values[(t90_values >= 1e-3) & (t90_values <= 1e3)]
 
     """
     Define custom bin edges for the T90 histogram
@@ -75,7 +115,7 @@ def create_time_data_plots(df, output_folder):
     """
     Plot the histogram for T90 duration distribution
     """
-    plt.figure(figsize=(10, 6))
+    fig = plt.figure(figsize=(10, 6))
     plt.hist(valid_t90, bins=bins, color='green', alpha=0.7)
     plt.xscale('log')
     plt.xlabel(r'T90 Duration [s]', fontsize=16)
@@ -86,19 +126,21 @@ def create_time_data_plots(df, output_folder):
     ax.xaxis.set_major_formatter(LogFormatterMathtext())  # Use scientific notation for x-axis
     ax.tick_params(axis='x', labelsize=14)
     ax.tick_params(axis='y', labelsize=14)
-    plt.savefig(os.path.join(output_dir, "T90_distribution.png"))
-    plt.show()
-    plt.close()
+    fig.savefig(os.path.join(output_dir, "T90_distribution.png"))
+    if show:
+        plt.show()
+    plt.close(fig)
 
 """
 Function: create_location_data_plots
 Input:
 - df (pd.DataFrame): DataFrame containing location data.
 - output_folder (str): Folder to save the plots.
+- show (bool): Whether to display the plot after saving it.
 Output:
 - None: Saves location-based plots to the specified folder.
 """
-def create_location_data_plots(df, output_folder):
+def create_location_data_plots(df, output_folder, show=False):
     output_dir = f"./{output_folder}/"
     os.makedirs(output_dir, exist_ok=True)
 
@@ -110,15 +152,20 @@ def create_location_data_plots(df, output_folder):
     plt.ylabel('DEC (DEG)', fontsize=16)
     plt.title('GRB Events Distribution', fontsize=18)
     plt.savefig(os.path.join(output_dir, "RA_DEC_plot.png"))
+    if show:
+        plt.show()
+    plt.close()
 
 """
 Function: plot_certain_event_prob_dist
 Input:
 - fits_file (str): Path to the FITS file.
+- output_folder (str): Folder to save the plot.
+- show (bool): Whether to display the plot after saving it.
 Output:
 - None: Saves a plot of the angular probability distribution.
 """
-def plot_certain_event_prob_dist(fits_file, output_folder):
+def plot_certain_event_prob_dist(fits_file, output_folder, show=False):
 
     """
     Create the output folder if it doesn't exist
@@ -126,21 +173,21 @@ def plot_certain_event_prob_dist(fits_file, output_folder):
     os.makedirs(output_folder, exist_ok=True)
 
     """
-    Load data from the FITS file
+    Load data from the FITS file, keeping the memory-mapped image instead of copying it
     """
-    with fits.open(fits_file) as hdul:
+    with fits.open(fits_file, memmap=True) as hdul:
         header = hdul[1].header
         RA_cent = header['CRVAL1']
         DEC_cent = header['CRVAL2']
         delta_RA = header['CDELT1']
         delta_DEC = header['CDELT2']
-        prob_dens_map = np.array(hdul[1].data)
+        prob_dens_map = hdul[1].data
         coordinates = RA_cent, DEC_cent, delta_RA, delta_DEC
 
     """
     Calculate the coordinate ranges
     """
-    image_size = [len(prob_dens_map), len(prob_dens_map[0])]
+    image_size = prob_dens_map.shape
     RA_min = RA_cent - (image_size[1] / 2) * delta_RA
     RA_max = RA_cent + (image_size[1] / 2) * delta_RA
     DEC_min = DEC_cent - (image_size[0] / 2) * delta_DEC
@@ -156,7 +203,8 @@ def plot_certain_event_prob_dist(fits_file, output_folder):
     plt.colorbar(label="Value")
     plt.title("GRB Probability Distribution", fontsize=18)
     plt.savefig(os.path.join(output_folder, "location_prob.png"))
-    plt.show()
+    if show:
+        plt.show()
     plt.close()
 
 """
@@ -169,17 +217,9 @@ Output:
 """
 def plot_count_rate(df, bins=256, plot_or_not=True):
     """
-    Create time bins
-    """
-    time = df['TIME']
-    bin_edges = np.linspace(time.min(), time.max(), bins)
-    bin_size = bin_edges[1] - bin_edges[0]
-    digitized = np.digitize(time, bin_edges)
-
-    """
-    Calculate count rate in each bin
+    Create time bins and calculate count rate in each bin
     """
-    count_rate = [np.sum(digitized == i) / bin_size for i in range(1, len(bin_edges))]
+    bin_edges, count_rate = uniform_count_rate(df['TIME'].to_numpy(), bins)
 
     """
     Plot count rate over time
@@ -198,9 +238,16 @@ def plot_count_rate(df, bins=256, plot_or_not=True):
 """
 Function: plot_light_curve_with_baseline_subtraction
 Input:
-
+- tte_file (str): Path to the TTE FITS file.
+- bcat_file (str): Path to the BCAT FITS file.
+- output_folder (str): Folder to save the plot.
+- bins (int): Number of bins for the light curve.
+- show (bool): Whether to display the plot after saving it.
+- cache_dir (str or None): Folder to cache the binned light curve in for later calls; None disables caching.
+Output:
+- None: Saves the light curve with its baseline to the specified folder.
 """
-def plot_light_curve_with_baseline_subtraction(tte_file, bcat_file, output_folder,bins=256):
+def plot_light_curve_with_baseline_subtraction(tte_file, bcat_file, output_folder,bins=256, show=False, cache_dir=None):
 
     """
     Create the output folder if it doesn't exist
@@ -216,27 +263,14 @@ def plot_light_curve_with_baseline_subtraction(tte_file, bcat_file, output_folde
         TSTOP = header['TSTOP']
     
     """
-    Load data from the TTE FITS file
-    """
-    with fits.open(tte_file) as hdul:
-        time = hdul['EVENTS'].data['TIME']
-
-    """
-    Create time bins
-    """
-    bin_edges = np.linspace(time.min(), time.max(), bins)
-    bin_size = bin_edges[1] - bin_edges[0]
-    digitized = np.digitize(time, bin_edges)
-
-    """
-    Calculate count rate in each bin
+    Load the binned count rate of the TTE events, reusing the one cached in cache_dir if given
     """
-    count_rate = [np.sum(digitized == i) / bin_size for i in range(1, len(bin_edges))]
+    bin_edges, count_rate = cached_tte_count_rate(tte_file, bins, cache_dir=cache_dir)
 
     """
     Calculate baseline of the count rate
     """
-    Baseline = np.average(count_rate)
+    Baseline = count_rate.mean()
 
     """
     Plot count rate over time
@@ -262,7 +296,10 @@ def plot_light_curve_with_baseline_subtraction(tte_file, bcat_file, output_folde
     plt.title('Count Rate vs Time for TTE Data')
     plt.legend()
     plt.grid()
-    plt.show()
+    plt.savefig(os.path.join(output_folder, "light_curve.png"))
+    if show:
+        plt.show()
+    plt.close()
 
 
 """
@@ -271,10 +308,13 @@ Input:
 - az (float or np.array): Azimuth angle.
 - zen (float or np.array): Zenith angle.
 - deg (bool): Whether the input is in degrees.
+- dtype (np.dtype): Floating point type of the computation; np.float32 halves the memory traffic.
 Output:
 - np.array: Cartesian coordinates.
 """
-def azzen_to_cartesian(az, zen, deg=True):
+def azzen_to_cartesian(az, zen, deg=True, dtype=np.float64):
+    az = np.asarray(az, dtype=dtype)
+    zen = np.asarray(zen, dtype=dtype)
     if deg:
         az = np.radians(az)
         zen = np.radians(zen)
@@ -286,27 +326,89 @@ def azzen_to_cartesian(az, zen, deg=True):
     return np.array([x, y, z])
 
 """
-Function: spacecraft_direction_cosines
+Unit pointing vectors of the GBM detectors in spacecraft coordinates, shape (3, 14), computed once
+"""
+_DETECTOR_DIRS_BODY = azzen_to_cartesian(_DETECTOR_AZZEN[:, 0], _DETECTOR_AZZEN[:, 1], deg=True)
+
+"""
+Function: spacecraft_direction_cosines_batch
 Input:
-- quat (np.array): Quaternion array.
+- Q (np.array): Quaternions, shape (N, 4), one (x, y, z, w) row per quaternion.
 Output:
-- np.array: Direction cosine matrix.
+- np.array: Direction cosine matrices, shape (3, 3, N).
 """
-def spacecraft_direction_cosines(quat):
+def spacecraft_direction_cosines_batch(Q):
     """
     Quaternion to Direction Cosine Matrix (DCM) conversion
     """
-    q1, q2, q3, q0 = quat # On Fermi, it's x, y, z, w
+    q1, q2, q3, q0 = Q[:, 0], Q[:, 1], Q[:, 2], Q[:, 3] # On Fermi, it's x, y, z, w
+
     """
-    Rotation matrix calculation based on quaternion components
+    Products shared between the matrix entries, computed once
     """
-    sc_cosines = np.array([
-        [1 - 2*(q2**2 + q3**2), 2*(q1*q2 - q0*q3), 2*(q1*q3 + q0*q2)],
-        [2*(q1*q2 + q0*q3), 1 - 2*(q1**2 + q3**2), 2*(q2*q3 - q0*q1)],
-        [2*(q1*q3 - q0*q2), 2*(q2*q3 + q0*q1), 1 - 2*(q1**2 + q2**2)]
-    ])
+    q11 = q1 * q1
+    q22 = q2 * q2
+    q33 = q3 * q3
+    q01 = q0 * q1
+    q02 = q0 * q2
+    q03 = q0 * q3
+    q12 = q1 * q2
+    q13 = q1 * q3
+    q23 = q2 * q3
+
+    """
+    Rotation matrix calculation based on quaternion components, filled entry by entry
+    """
+    sc_cosines = np.empty((3, 3, Q.shape[0]), dtype=np.result_type(Q.dtype, np.float32))
+    sc_cosines[0, 0] = 1 - 2*(q22 + q33)
+    sc_cosines[0, 1] = 2*(q12 - q03)
+    sc_cosines[0, 2] = 2*(q13 + q02)
+    sc_cosines[1, 0] = 2*(q12 + q03)
+    sc_cosines[1, 1] = 1 - 2*(q11 + q33)
+    sc_cosines[1, 2] = 2*(q23 - q01)
+    sc_cosines[2, 0] = 2*(q13 - q02)
+    sc_cosines[2, 1] = 2*(q23 + q01)
+    sc_cosines[2, 2] = 1 - 2*(q11 + q22)
     return sc_cosines
 
+"""
+Function: spacecraft_direction_cosines
+Input:
+- quat (np.array): Quaternion array, shape (4,) or (4, N).
+- dtype (np.dtype): Floating point type of the computation.
+Output:
+- np.array: Direction cosine matrix, shape (3, 3) or (3, 3, N).
+"""
+def spacecraft_direction_cosines(quat, dtype=np.float64):
+    quat = np.asarray(quat, dtype=dtype)
+    sc_cosines = spacecraft_direction_cosines_batch(np.atleast_2d(quat.T))
+    if quat.ndim == 1:
+        return sc_cosines[:, :, 0]
+    return sc_cosines
+
+"""
+Function: cartesian_to_radec
+Input:
+- cartesian_pos (np.array): J2000 unit vectors, shape (3, ...). The z row is clipped in place.
+- deg (bool): Whether the output is in degrees.
+Output:
+- tuple: RA and Dec arrays with the trailing shape of cartesian_pos.
+"""
+def cartesian_to_radec(cartesian_pos, deg=True):
+    np.clip(cartesian_pos[2], -1.0, 1.0, out=cartesian_pos[2])
+
+    """
+    Transform Cartesian position to RA/Dec in J2000 frame
+    """
+    dec = np.arcsin(cartesian_pos[2])
+    ra = np.mod(np.arctan2(cartesian_pos[1], cartesian_pos[0]), 2.0 * np.pi)
+
+    if deg:
+        ra = np.rad2deg(ra)
+        dec = np.rad2deg(dec)
+
+    return ra, dec
+
 """
 Function: spacecraft_to_radec
 Input:
@@ -314,10 +416,11 @@ Input:
 - zen (float or np.array): Zenith angle.
 - quat (np.array): Quaternion array.
 - deg (bool): Whether the input/output is in degrees.
+- dtype (np.dtype): Floating point type of the computation; np.float32 is good to ~1e-4 deg away from the poles.
 Output:
 - tuple: RA and Dec in J2000 frame.
 """
-def spacecraft_to_radec(az, zen, quat, deg=True):
+def spacecraft_to_radec(az, zen, quat, deg=True, dtype=np.float64):
     ndim = len(quat.shape)
     if ndim == 2:
         numquats = quat.shape[1]
@@ -327,7 +430,7 @@ def spacecraft_to_radec(az, zen, quat, deg=True):
     """
     Convert azimuth and zenith to Cartesian coordinates
     """
-    pos = azzen_to_cartesian(az, zen, deg=deg)
+    pos = azzen_to_cartesian(az, zen, deg=deg, dtype=dtype)
     ndim = len(pos.shape)
     if ndim == 2:
         numpos = pos.shape[1]
@@ -335,60 +438,185 @@ def spacecraft_to_radec(az, zen, quat, deg=True):
         numpos = 1
 
     """
-    Spacecraft direction cosine matrix
-    """
-    sc_cosines = spacecraft_direction_cosines(quat)
-
+    Handle different cases: one sky position over many transforms, or multiple positions with one transform.
+    A single position or transform keeps a length-1 last axis and is broadcast by einsum without copying.
     """
-    Handle different cases: one sky position over many transforms, or multiple positions with one transform
-    """
-    if (numpos == 1) & (numquats > 1):
-        pos = np.repeat(pos, numquats).reshape(3, -1)
-        numdo = numquats
-    elif (numpos > 1) & (numquats == 1):
-        sc_cosines = np.repeat(sc_cosines, numpos).reshape(3, 3, -1)
-        numdo = numpos
-    elif numpos == numquats:
-        numdo = numpos
-        if numdo == 1:
-            sc_cosines = sc_cosines[:, :, np.newaxis]
-            pos = pos[:, np.newaxis]
-    else:
+    if (numpos > 1) & (numquats > 1) & (numpos != numquats):
         raise ValueError(
             'If the size of az/zen coordinates is > 1 AND the size of quaternions is > 1, then they must be of the same size'
         )
+    numdo = max(numpos, numquats)
 
     """
-    Convert numpy arrays to list of arrays for vectorized calculations
+    With numba and more than one thread, rotate and convert all N pairs in one fused parallel
+    loop without building the (3, 3, N) matrices; on a single thread the NumPy path is faster
     """
-    sc_cosines_list = np.squeeze(np.split(sc_cosines, numdo, axis=2))
-    pos_list = np.squeeze(np.split(pos, numdo, axis=1))
-    if numdo == 1:
-        sc_cosines_list = [sc_cosines_list]
-        pos_list = [pos_list]
+    if numdo > 1 and _sc_to_radec is not None and np.dtype(dtype) == np.float64 and get_num_threads() > 1:
+        Q = np.ascontiguousarray(np.atleast_2d(np.asarray(quat, dtype=np.float64).T))
+        P = np.ascontiguousarray(pos.reshape(3, -1))
+        return _sc_to_radec(Q, P, deg)
 
     """
-    Convert position to J2000 frame
+    Spacecraft direction cosine matrix
     """
-    cartesian_pos = np.array(list(map(np.dot, sc_cosines_list, pos_list))).T
-    cartesian_pos[2, (cartesian_pos[2, np.newaxis] < -1.0).reshape(-1)] = -1.0
-    cartesian_pos[2, (cartesian_pos[2, np.newaxis] > 1.0).reshape(-1)] = 1.0
+    sc_cosines = spacecraft_direction_cosines(quat, dtype=dtype)
 
     """
-    Transform Cartesian position to RA/Dec in J2000 frame
+    One position and one transform: scalar math is cheaper than array ufuncs
     """
-    dec = np.arcsin(cartesian_pos[2, np.newaxis])
-    ra = np.arctan2(cartesian_pos[1, np.newaxis], cartesian_pos[0, np.newaxis])
-    ra[(np.abs(cartesian_pos[1, np.newaxis]) < 1e-6) & (
-                np.abs(cartesian_pos[0, np.newaxis]) < 1e-6)] = 0.0
-    ra[ra < 0.0] += 2.0 * np.pi
+    if numdo == 1:
+        x, y, z = (float(v) for v in sc_cosines.reshape(3, 3) @ pos.reshape(3))
+        dec = math.asin(max(-1.0, min(1.0, z)))
+        ra = math.atan2(y, x)
+        if ra < 0.0:
+            ra += 2.0 * math.pi
+        if deg:
+            ra = math.degrees(ra)
+            dec = math.degrees(dec)
+        return ra, dec
 
-    if deg:
-        ra = np.rad2deg(ra)
-        dec = np.rad2deg(dec)
-    
+    if numquats == 1:
+        sc_cosines = sc_cosines.reshape(3, 3, 1)
+    if numpos == 1:
+        pos = pos.reshape(3, 1)
+
+    """
+    Convert position to J2000 frame with one batched matrix-vector product
+    """
+    cartesian_pos = np.einsum('ijn,jn->in', sc_cosines, pos)
+
+    ra, dec = cartesian_to_radec(cartesian_pos, deg=deg)
     return np.squeeze(ra), np.squeeze(dec)
 
+"""
+Function: RA_DEC_detector_at_quat
+Input:
+- detector_name (str): GBM detector name ('n0'-'n9', 'na', 'nb', 'b0', 'b1').
+- quat (np.array): Quaternion array.
+Output:
+- tuple: RA and Dec of the detector pointing in J2000 frame, in degrees.
+"""
+def RA_DEC_detector_at_quat(detector_name, quat):
+    az, zen = _DETECTOR_AZZEN[_DETECTOR_INDEX[detector_name]]
+    return spacecraft_to_radec(az, zen, quat, deg=True)
+
+"""
+Function: _dcm_entries
+Input:
+- q1, q2, q3, q0 (float): Quaternion components, in Fermi's x, y, z, w order.
+Output:
+- tuple: The nine direction cosine matrix entries, row by row.
+
+Function: _rotate_to_radec
+Input:
+- m (tuple): Direction cosine matrix entries from _dcm_entries.
+- px, py, pz (float): Unit vector in spacecraft coordinates.
+Output:
+- tuple: RA in [0, 2pi) and Dec of the rotated vector, in radians.
+
+Function: _detectors_to_radec
+Input:
+- Q (np.array): Quaternions, shape (N, 4), one (x, y, z, w) row per quaternion.
+- dirs (np.array): Detector unit vectors in spacecraft coordinates, shape (3, D).
+- deg (bool): Whether the output is in degrees.
+Output:
+- tuple: RA and Dec of every detector pointing in J2000 frame, each of shape (D, N).
+
+Function: _sc_to_radec
+Input:
+- Q (np.array): Quaternions, shape (1, 4) or (N, 4).
+- P (np.array): Unit vectors in spacecraft coordinates, shape (3, 1) or (3, N).
+- deg (bool): Whether the output is in degrees.
+Output:
+- tuple: RA and Dec of each (quaternion, vector) pair in J2000 frame, each of shape (N,).
+"""
+if njit is not None:
+    @njit(cache=True)
+    def _dcm_entries(q1, q2, q3, q0):
+        return (1 - 2*(q2*q2 + q3*q3), 2*(q1*q2 - q0*q3), 2*(q1*q3 + q0*q2),
+                2*(q1*q2 + q0*q3), 1 - 2*(q1*q1 + q3*q3), 2*(q2*q3 - q0*q1),
+                2*(q1*q3 - q0*q2), 2*(q2*q3 + q0*q1), 1 - 2*(q1*q1 + q2*q2))
+
+    @njit(cache=True)
+    def _rotate_to_radec(m, px, py, pz):
+        x = m[0]*px + m[1]*py + m[2]*pz
+        y = m[3]*px + m[4]*py + m[5]*pz
+        z = m[6]*px + m[7]*py + m[8]*pz
+        z = min(max(z, -1.0), 1.0)
+        r = np.arctan2(y, x)
+        if r < 0.0:
+            r += 2.0 * np.pi
+        return r, np.arcsin(z)
+
+    @njit(parallel=True, cache=True)
+    def _detectors_to_radec(Q, dirs, deg):
+        N = Q.shape[0]
+        D = dirs.shape[1]
+        ra = np.empty((D, N))
+        dec = np.empty((D, N))
+        for n in prange(N):
+            m = _dcm_entries(Q[n, 0], Q[n, 1], Q[n, 2], Q[n, 3])
+            for d in range(D):
+                ra[d, n], dec[d, n] = _rotate_to_radec(m, dirs[0, d], dirs[1, d], dirs[2, d])
+        if deg:
+            ra = np.rad2deg(ra)
+            dec = np.rad2deg(dec)
+        return ra, dec
+
+    @njit(parallel=True, cache=True)
+    def _sc_to_radec(Q, P, deg):
+        NQ = Q.shape[0]
+        NP = P.shape[1]
+        N = max(NQ, NP)
+        ra = np.empty(N)
+        dec = np.empty(N)
+        for n in prange(N):
+            qi = min(np.int64(n), NQ - 1)
+            pj = min(np.int64(n), NP - 1)
+            m = _dcm_entries(Q[qi, 0], Q[qi, 1], Q[qi, 2], Q[qi, 3])
+            ra[n], dec[n] = _rotate_to_radec(m, P[0, pj], P[1, pj], P[2, pj])
+        if deg:
+            ra = np.rad2deg(ra)
+            dec = np.rad2deg(dec)
+        return ra, dec
+else:
+    _detectors_to_radec = None
+    _sc_to_radec = None
+
+"""
+Function: RA_DEC_all_detectors
+Input:
+- quat (np.array): Quaternion array, shape (4,) or (4, N).
+- deg (bool): Whether the output is in degrees.
+- dtype (np.dtype): Floating point type of the computation; np.float32 is good to ~1e-4 deg away from the poles.
+Output:
+- tuple: RA and Dec of all 14 detector pointings in J2000 frame, each of shape (14,) or (14, N).
+"""
+def RA_DEC_all_detectors(quat, deg=True, dtype=np.float64):
+    """
+    With numba and more than one thread, rotate and convert every detector pointing in one
+    fused parallel loop; on a single thread NumPy's SIMD trig ufuncs below are faster
+    """
+    if _detectors_to_radec is not None and np.dtype(dtype) == np.float64 and get_num_threads() > 1:
+        Q = np.ascontiguousarray(np.atleast_2d(np.asarray(quat, dtype=np.float64).T))
+        ra, dec = _detectors_to_radec(Q, _DETECTOR_DIRS_BODY, deg)
+        if quat.ndim == 1:
+            return ra[:, 0], dec[:, 0]
+        return ra, dec
+
+    """
+    Build the direction cosine matrices once and rotate every detector pointing with them
+    """
+    sc_cosines = spacecraft_direction_cosines(quat, dtype=dtype)
+    if sc_cosines.ndim == 2:
+        sc_cosines = sc_cosines[:, :, np.newaxis]
+    cartesian_pos = np.einsum('ijn,jd->idn', sc_cosines, _DETECTOR_DIRS_BODY.astype(dtype, copy=False))
+
+    ra, dec = cartesian_to_radec(cartesian_pos, deg=deg)
+    if quat.ndim == 1:
+        return ra[:, 0], dec[:, 0]
+    return ra, dec
+
 """
 Function: detector_orientation
 Input:
@@ -398,41 +626,16 @@ Output:
 """
 def detector_orientation(df):
     """
-    Calculate RA and DEC for all detectors at a given quaternion
-    """
-    def RA_DEC_all_detector_at_quat(row):
-        quat = np.array([row['QSJ_1'], row['QSJ_2'], row['QSJ_3'], row['QSJ_4']])
-
-        detectors = {
-            'n0': ('NAI_00', 0, 45.89, 90.00 - 20.58),
-            'n1': ('NAI_01', 1, 45.11, 90.00 - 45.31),
-            'n2': ('NAI_02', 2, 58.44, 90.00 - 90.21),
-            'n3': ('NAI_03', 3, 314.87, 90.00 - 45.24),
-            'n4': ('NAI_04', 4, 303.15, 90.00 - 90.27),
-            'n5': ('NAI_05', 5, 3.35, 90.00 - 89.79),
-            'n6': ('NAI_06', 6, 224.93, 90.00 - 20.43),
-            'n7': ('NAI_07', 7, 224.62, 90.00 - 46.18),
-            'n8': ('NAI_08', 8, 236.61, 90.00 - 89.97),
-            'n9': ('NAI_09', 9, 135.19, 90.00 - 45.55),
-            'na': ('NAI_10', 10, 123.73, 90.00 - 90.42),
-            'nb': ('NAI_11', 11, 183.74, 90.00 - 90.32),
-            'b0': ('BGO_00', 12, 0.00, 90.00 - 90.00),
-            'b1': ('BGO_01', 13, 180.00, 90.00 - 90.00),
-        }
-
-        ra_dec_dict = {}
-        for key, (_, _, az, zen) in detectors.items():
-            ra, dec = spacecraft_to_radec(az, zen, quat, deg=True)
-            ra_dec_dict[key] = (ra, dec)
-        return ra_dec_dict
-
-    orientation = []
-    for _, row in df.iterrows():
-        ra_dec_dict = RA_DEC_all_detector_at_quat(row)
-
-        for name, (ra, dec) in ra_dec_dict.items():
-            orientation.append(azzen_to_cartesian(ra, dec))
-    return orientation
+    Calculate RA and DEC for all detectors at every quaternion in one batch
+    """
+    quat = df[['QSJ_1', 'QSJ_2', 'QSJ_3', 'QSJ_4']].to_numpy(dtype=float).T
+    ra, dec = RA_DEC_all_detectors(quat)
+
+    """
+    One orientation per (row, detector), ordered by row and then by detector
+    """
+    orientation = azzen_to_cartesian(ra.T.ravel(), dec.T.ravel())
+    return list(orientation.T)
 
 """
 Function: plot_all_detector_positions
@@ -444,67 +647,51 @@ Output:
 """
 def plot_all_detector_positions(df, output_dir="detector_plots", plt_show_or_not=False):
     """
-    Calculate RA and DEC for all detectors at a given quaternion
-    """
-    def RA_DEC_all_detector_at_quat(row):
-        quat = np.array([row['QSJ_1'], row['QSJ_2'], row['QSJ_3'], row['QSJ_4']])
-
-        detectors = {
-            'n0': ('NAI_00', 0, 45.89, 90.00 - 20.58),
-            'n1': ('NAI_01', 1, 45.11, 90.00 - 45.31),
-            'n2': ('NAI_02', 2, 58.44, 90.00 - 90.21),
-            'n3': ('NAI_03', 3, 314.87, 90.00 - 45.24),
-            'n4': ('NAI_04', 4, 303.15, 90.00 - 90.27),
-            'n5': ('NAI_05', 5, 3.35, 90.00 - 89.79),
-            'n6': ('NAI_06', 6, 224.93, 90.00 - 20.43),
-            'n7': ('NAI_07', 7, 224.62, 90.00 - 46.18),
-            'n8': ('NAI_08', 8, 236.61, 90.00 - 89.97),
-            'n9': ('NAI_09', 9, 135.19, 90.00 - 45.55),
-            'na': ('NAI_10', 10, 123.73, 90.00 - 90.42),
-            'nb': ('NAI_11', 11, 183.74, 90.00 - 90.32),
-            'b0': ('BGO_00', 12, 0.00, 90.00 - 90.00),
-            'b1': ('BGO_01', 13, 180.00, 90.00 - 90.00),
-        }
-
-        ra_dec_dict = {}
-        for key, (_, num, az, zen) in detectors.items():
-            ra, dec = spacecraft_to_radec(az, zen, quat, deg=True)
-            ra_dec_dict[key] = (ra, dec, num)
-        return ra_dec_dict
+    Calculate RA and DEC for all detectors at every quaternion in one batch
+    """
+    quat = df[['QSJ_1', 'QSJ_2', 'QSJ_3', 'QSJ_4']].to_numpy(dtype=float).T
+    ra_all, dec_all = RA_DEC_all_detectors(quat)
 
     """
     Create output directory if it doesn't exist
     """
     os.makedirs(output_dir, exist_ok=True)
-    import matplotlib.cm as cm
-    import matplotlib.colors as mcolors
+    detector_colors = _TAB20(np.arange(len(_DETECTOR_INDEX)))
 
-    colors = cm.get_cmap('tab20', 14)
+    """
+    Label alignment per detector, fixed for every GRB; n5 and nb sit below-left of their marker
+    """
+    label_align = [('right', 'top') if num in (5, 11) else ('left', 'bottom') for num in _DETECTOR_INDEX.values()]
 
-    for _, row in df.iterrows():
-        ra_dec_dict = RA_DEC_all_detector_at_quat(row)
-    
-        plt.figure(figsize=(10, 8))
-        for name, (ra, dec, num) in ra_dec_dict.items():
-            plt.scatter(ra, dec, s=100, c=colors(num), alpha=0.5, label=name)
-            if num==5 or num==11:
-                plt.text(ra, dec, f"{name}", fontsize=16, ha='right', va='top')
-            else:
-                plt.text(ra, dec, f"{name}", fontsize=16, ha='left', va='bottom')
-
-        plt.xlabel("Right Ascension (deg)", fontsize=14)
-        plt.ylabel("Declination (deg)", fontsize=14)
-        plt.title("GRB " + str(row['ID']), fontsize=16)
-        plt.grid(True)
-        plt.tight_layout()
-
-        filename = os.path.join(output_dir, f"GRB_{row['ID']}.png")
-        plt.savefig(filename)
+    """
+    Reuse one figure for every GRB, clearing the axes between saves. When the plots are shown,
+    each GRB gets its own figure: closing a shown window unregisters its figure from pyplot
+    """
+    fig = None
+    for n, grb_id in enumerate(df['ID'].to_numpy()):
+        if fig is None or plt_show_or_not:
+            fig, ax = plt.subplots(figsize=(10, 8))
+        else:
+            ax.clear()
+        ax.scatter(ra_all[:, n], dec_all[:, n], s=100, c=detector_colors, alpha=0.5)
+        for (name, num), (ha, va) in zip(_DETECTOR_INDEX.items(), label_align):
+            ax.text(ra_all[num, n], dec_all[num, n], name, fontsize=16, ha=ha, va=va)
+
+        ax.set_xlabel("Right Ascension (deg)", fontsize=14)
+        ax.set_ylabel("Declination (deg)", fontsize=14)
+        ax.set_title("GRB " + str(grb_id), fontsize=16)
+        ax.grid(True)
+        fig.tight_layout()
+
+        filename = os.path.join(output_dir, f"GRB_{grb_id}.png")
+        fig.savefig(filename)
         if plt_show_or_not:
             plt.show()
-        plt.close()
+            plt.close(fig)
+    if fig is not None:
+        plt.close(fig)
 
-def evaluate_model_and_plot_accurracy(model, history, X_test_scaled, y_test):
+def evaluate_model_and_plot_accurracy(model, history, X_test_scaled, y_test, show=True):
     # Evaluate the model (if loaded or newly trained)
     loss, cosine_sim = model.evaluate(X_test_scaled, y_test)
     print(f"Test Loss: {loss:.4f}")
@@ -517,6 +704,7 @@ def evaluate_model_and_plot_accurracy(model, history, X_test_scaled, y_test):
     print("Standard deviation of norms:", np.std(norms))
 
     # Plot loss
+    plt.figure()
     plt.plot(history.history['loss'], label='Train Loss')
     plt.plot(history.history['val_loss'], label='Validation Loss')
     plt.xlabel('Epochs')
@@ -524,9 +712,12 @@ def evaluate_model_and_plot_accurracy(model, history, X_test_scaled, y_test):
     plt.title('Loss Evolution During Training')
     plt.legend()
     plt.grid(True)
-    plt.show()
+    if show:
+        plt.show()
+    plt.close()
 
     # Plot cosine similarity
+    plt.figure()
     plt.plot(history.history['cosine_similarity'], label='Train Cosine Similarity')
     plt.plot(history.history['val_cosine_similarity'], label='Validation Cosine Similarity')
     plt.xlabel('Epochs')
@@ -534,5 +725,7 @@ def evaluate_model_and_plot_accurracy(model, history, X_test_scaled, y_test):
     plt.title('Cosine Similarity Evolution During Training')
     plt.legend()
     plt.grid(True)
-    plt.show()
+    if show:
+        plt.show()
+    plt.close()
     return history.history['cosine_similarity'], history.history['val_cosine_similarity']
@@ -0,0 +1,75 @@
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+from gw_grb_correlation.Fermi import util
+
+def rotation_about_z(angle_deg):
+    half = np.radians(angle_deg) / 2
+    return [0.0, 0.0, np.sin(half), np.cos(half)]
+
+class TestInterpolateQsForTime(unittest.TestCase):
+
+    def setUp(self):
+        qs = [rotation_about_z(0), rotation_about_z(0), rotation_about_z(90), rotation_about_z(90)]
+        self.df = pd.DataFrame(qs, columns=['QSJ_1', 'QSJ_2', 'QSJ_3', 'QSJ_4'])
+        self.df.insert(0, 'TSTART', [0.0, 1.0, 2.0, 3.0])
+
+    def test_returns_samples_at_sample_times(self):
+        result = util.interpolate_qs_for_time(self.df, self.df['TSTART'])
+        np.testing.assert_allclose(result.to_numpy(), self.df.to_numpy(), atol=1e-12)
+
+    def test_slerp_between_samples(self):
+        result = util.interpolate_qs_for_time(self.df, [1.5])
+        np.testing.assert_allclose(result.iloc[0, 1:].to_numpy(), rotation_about_z(45), atol=1e-12)
+
+    def test_frame_differing_only_in_tstart(self):
+        util.interpolate_qs_for_time(self.df, [1.5])
+        edited = self.df.copy()
+        edited.loc[1, 'TSTART'] = 0.5
+        result = util.interpolate_qs_for_time(edited, [1.5])
+        np.testing.assert_allclose(result.iloc[0, 1:].to_numpy(), rotation_about_z(60), atol=1e-12)
+
+    def test_unsorted_and_incomplete_samples(self):
+        messy = pd.concat([self.df, pd.DataFrame({'TSTART': [1.2], 'QSJ_1': [np.nan]})])
+        messy = messy.sample(frac=1, random_state=0)
+        times = [0.25, 1.5, 2.75]
+        pd.testing.assert_frame_equal(util.interpolate_qs_for_time(messy, times),
+                                      util.interpolate_qs_for_time(self.df, times))
+
+    def test_nan_outside_sampled_range(self):
+        result = util.interpolate_qs_for_time(self.df, [-1.0, 4.0])
+        self.assertTrue(result[['QSJ_1', 'QSJ_2', 'QSJ_3', 'QSJ_4']].isna().all().all())
+
+class TestUniformCountRate(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.time = np.sort(np.concatenate([[0.0, 100.0], rng.uniform(0.0, 100.0, 5000)]))
+
+    def histogram_counts(self, time, bins):
+        bin_edges, count_rate = util.uniform_count_rate(time, bins)
+        counts = np.rint(count_rate * (bin_edges[1] - bin_edges[0])).astype(int)
+        expected, _ = np.histogram(time, bins=bin_edges)
+        return counts, expected
+
+    def test_counts_match_np_histogram(self):
+        bins = 65
+        edges = np.linspace(0.0, 100.0, bins)
+        away_from_edges = np.abs(self.time[:, None] - edges[1:-1]).min(axis=1) > 1e-9
+        time = self.time[away_from_edges]
+        for histogram1d in (util.histogram1d, None):
+            with mock.patch.object(util, 'histogram1d', histogram1d):
+                counts, expected = self.histogram_counts(time, bins)
+                np.testing.assert_array_equal(counts, expected)
+
+    def test_edge_ties_only_move_to_neighbouring_bin(self):
+        time = np.arange(0.0, 100.5, 0.5)
+        for histogram1d in (util.histogram1d, None):
+            with mock.patch.object(util, 'histogram1d', histogram1d):
+                counts, expected = self.histogram_counts(time, 65)
+                self.assertEqual(counts.sum(), expected.sum())
+                self.assertLessEqual(np.abs(np.cumsum(counts - expected)).max(), 1)
+
+if __name__ == '__main__':
+    unittest.main()